@@ -5,16 +5,70 @@ Sử dụng tinh_thanh.json làm ground truth
 
 import sys
 import os
-import json
-import csv
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import orjson
 
 # Thêm thư mục gốc vào path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.province_comparator import ProvinceComparator
+from src.province_comparator import ProvinceComparator, read_address_pairs
+
+
+# Số cặp gửi cho mỗi worker 1 lần
+WORKER_CHUNKSIZE = 1000
+
+# Comparator riêng của từng worker process
+_worker_comparator = None
+
+
+def _init_worker(ground_truth_file):
+    """Khởi tạo comparator 1 lần cho mỗi worker process"""
+    global _worker_comparator
+    _worker_comparator = ProvinceComparator(ground_truth_file, verbose=False)
 
 
-def process_csv(csv_file, ground_truth_file, output_file):
+def _compare_pair(pair):
+    """So sánh 1 cặp (index, addr1, addr2) trong worker process"""
+    index, addr1, addr2 = pair
+    return _worker_comparator.compare_address_pair(addr1, addr2, index)
+
+
+def compare_pairs(pairs, ground_truth_file, workers=1):
+    """
+    So sánh các cặp địa chỉ, song song trên nhiều process nếu workers > 1
+    
+    Args:
+        pairs: Iterable các tuple (index, addr1, addr2)
+        ground_truth_file: File ground truth
+        workers: Số process dùng để so sánh (mỗi lần chỉ đọc và giữ trong bộ nhớ
+            tối đa WORKER_CHUNKSIZE * workers cặp)
+        
+    Yields:
+        Dictionary kết quả cho từng cặp, theo đúng thứ tự input
+    """
+    if workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(ground_truth_file,)
+        ) as executor:
+            # executor.map submit toàn bộ iterable ngay lập tức, nên chia input thành
+            # từng cửa sổ giới hạn để không đọc hết CSV và giữ mọi kết quả trong bộ nhớ
+            pairs = iter(pairs)
+            window_size = WORKER_CHUNKSIZE * workers
+            while True:
+                window = list(itertools.islice(pairs, window_size))
+                if not window:
+                    break
+                yield from executor.map(_compare_pair, window, chunksize=WORKER_CHUNKSIZE)
+    else:
+        comparator = ProvinceComparator(ground_truth_file)
+        yield from comparator.compare_batch(pairs)
+
+
+def process_csv(csv_file, ground_truth_file, output_file, workers=1):
     """
     Xử lý file CSV và so sánh các cặp địa chỉ
     
@@ -22,39 +76,44 @@ def process_csv(csv_file, ground_truth_file, output_file):
         csv_file: File CSV input
         ground_truth_file: File ground truth
         output_file: File JSON output
+        workers: Số process dùng để so sánh (> 1 để chạy song song)
     """
     print("🚀 BẮT ĐẦU SO SÁNH ĐỊA CHỈ")
     print("=" * 80)
     
-    # Khởi tạo comparator
-    comparator = ProvinceComparator(ground_truth_file)
-    
-    # Đọc CSV
+    # Đọc CSV, so sánh và ghi kết quả trực tiếp ra file (chỉ giữ bộ đếm trong bộ nhớ)
     print(f"\n📖 Đang đọc file CSV: {csv_file}")
-    results = []
+    results = compare_pairs(read_address_pairs(csv_file), ground_truth_file, workers)
+    total = 0
+    matched = 0
+    samples = []
     
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        reader = csv.reader(f)
-        
-        for row in reader:
-            # Skip empty rows or rows with MISMATCH/Ambiguity labels
-            if not row or len(row) < 3:
-                continue
-            if len(row) > 3 and row[3] in ['MISMATCH', 'Ambiguity']:
-                # Skip rows marked as MISMATCH or Ambiguity in column 4
-                continue
+    # Ghi ra file tạm rồi rename khi xong, để lỗi giữa chừng (CSV lỗi encoding,
+    # worker lỗi...) không ghi đè file kết quả cũ bằng JSON dở dang
+    tmp_file = os.fspath(output_file) + '.tmp'
+    try:
+        with open(tmp_file, 'wb') as f:
+            for result in results:
+                # Giữ định dạng như json.dump(indent=2): mỗi record thụt lề 2 space
+                f.write(b'[\n  ' if total == 0 else b',\n  ')
+                f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2).replace(b'\n', b'\n  '))
+                
+                total += 1
+                if result['match']:
+                    matched += 1
+                if len(samples) < 5:
+                    samples.append(result)
             
-            index = row[0].strip()
-            addr1 = row[1].strip()
-            addr2 = row[2].strip()
-            
-            if addr1 and addr2:
-                result = comparator.compare_address_pair(addr1, addr2, index)
-                results.append(result)
+            f.write(b'\n]' if total else b'[]')
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
+    os.replace(tmp_file, output_file)
     
     # Thống kê
-    total = len(results)
-    matched = sum(1 for r in results if r['match'])
     mismatched = total - matched
     
     print(f"\n📊 THỐNG KÊ:")
@@ -67,16 +126,12 @@ def process_csv(csv_file, ground_truth_file, output_file):
         print("⚠️  Không có dữ liệu để so sánh")
     print("=" * 80)
     
-    # Lưu kết quả
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
-    
-    print(f"\n💾 Đã lưu {len(results)} kết quả vào: {output_file}")
+    print(f"\n💾 Đã lưu {total} kết quả vào: {output_file}")
     
     # Hiển thị ví dụ
     print("\n📋 VÍ DỤ KẾT QUẢ (5 cặp đầu tiên):")
     print("-" * 80)
-    for result in results[:5]:
+    for result in samples:
         status = "✅" if result['match'] else "❌"
         print(f"\n{status} [{result['index']}] {result['reason']}")
         print(f"  Addr1: {result['address1'][:60]}...")
@@ -84,7 +139,7 @@ def process_csv(csv_file, ground_truth_file, output_file):
         print(f"  Addr2: {result['address2'][:60]}...")
         print(f"  => {result['province2']}")
     
-    return results
+    return {"total": total, "matched": matched, "mismatched": mismatched}
 
 
 def main():
@@ -93,7 +148,7 @@ def main():
     ground_truth_file = r'C:\Users\Admin\Desktop\Address_Solving\address_solving_v2\data\tinh_thanh.json'
     output_file = r'C:\Users\Admin\Desktop\Address_Solving\address_solving_v2\tests\test_data\address_comparison_output.json'
     
-    results = process_csv(csv_file, ground_truth_file, output_file)
+    process_csv(csv_file, ground_truth_file, output_file)
     
     print("\n✅ Hoàn tất!")
     print(f"\n💡 File kết quả: {output_file}")
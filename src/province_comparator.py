@@ -5,17 +5,83 @@ Contains the ProvinceComparator class for extracting and comparing
 Vietnamese province names from addresses.
 """
 
+import csv
+import functools
 import json
+import os
+import pickle
 import re
 
+import ahocorasick
+
+
+# Ký tự phân cách dùng để xác định word boundary, tương đương [\s,;.\-/] của regex.
+# Khoảng trắng Unicode lớn nhất là U+3000 (ideographic space).
+_SEPARATORS = frozenset(',;.-/').union(
+    ch for ch in map(chr, range(0x3001)) if ch.isspace()
+)
+
+
+# Dấu hiệu tên tỉnh cũ thực sự (không phải abbreviation)
+_PROVINCE_MARKERS = re.compile(r'Tỉnh|Thành phố|TP')
+
+# Nhãn ở cột 4 của file CSV cần bỏ qua
+SKIPPED_LABELS = frozenset({'MISMATCH', 'Ambiguity'})
+
+# Cache trên đĩa cho các cấu trúc build từ ground truth (đặt cạnh file JSON)
+CACHE_SUFFIX = '.cache.pkl'
+
+# Tăng khi thay đổi cấu trúc dữ liệu được cache
+_CACHE_VERSION = 2
+
+# Các thuộc tính được build từ ground truth và lưu vào cache
+_CACHED_ATTRIBUTES = (
+    'ground_truth', 'variant_to_official', 'merged_provinces', '_automaton'
+)
+
+
+def _file_signature(path):
+    """(mtime_ns, size) của file, dùng để kiểm tra cache còn khớp với ground truth"""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
 
 class ProvinceComparator:
     """Class để so sánh địa chỉ dựa trên ground truth"""
     
-    def __init__(self, ground_truth_file):
+    def __init__(self, ground_truth_file, verbose=True, use_cache=True):
         """
         Khởi tạo với file ground truth
         
+        Args:
+            ground_truth_file: File tinh_thanh.json
+            verbose: In thông tin sau khi load (tắt khi chạy trong worker process)
+            use_cache: Dùng cache pickle cạnh file ground truth thay vì build lại
+        """
+        if use_cache:
+            cache_file = os.fspath(ground_truth_file) + CACHE_SUFFIX
+            # Lấy signature trước khi đọc JSON: nếu file đổi trong lúc build,
+            # cache ghi ra sẽ không khớp và được build lại ở lần sau
+            signature = _file_signature(ground_truth_file)
+            if not self._load_cache(cache_file, signature):
+                self._build(ground_truth_file)
+                self._save_cache(cache_file, signature)
+        else:
+            self._build(ground_truth_file)
+        
+        # Cache kết quả theo địa chỉ gốc (CSV thường lặp lại cùng 1 địa chỉ)
+        self._extract_province_cached = functools.lru_cache(maxsize=100000)(
+            self._extract_province_impl
+        )
+        
+        if verbose:
+            print(f"✅ Loaded {len(self.ground_truth)} provinces as ground truth")
+            print(f"✅ Total variants: {len(self.variant_to_official)}")
+    
+    def _build(self, ground_truth_file):
+        """
+        Đọc ground truth và build các mapping + automaton
+        
         Args:
             ground_truth_file: File tinh_thanh.json
         """
@@ -41,13 +107,63 @@ class ProvinceComparator:
             # old_provinces_list là các tỉnh cũ được sáp nhập
             for old_prov in old_provinces_list:
                 # Nếu old_prov là tên tỉnh cũ thực sự (không phải abbreviation)
-                if any(p in old_prov for p in ['Tỉnh', 'Thành phố', 'TP']):
+                if _PROVINCE_MARKERS.search(old_prov):
                     # Map old province -> new province
                     old_official = self.variant_to_official.get(old_prov, old_prov)
                     self.merged_provinces[old_official] = new_province
         
-        print(f"✅ Loaded {len(self.ground_truth)} provinces as ground truth")
-        print(f"✅ Total variants: {len(self.variant_to_official)}")
+        # Gộp variants theo dạng lowercase (key trùng giữ official của key sau cùng)
+        variants_lower = {}
+        for variant, official in self.variant_to_official.items():
+            variants_lower[variant.lower()] = official
+        
+        # Automaton Aho-Corasick để quét tất cả variants trong 1 lần duyệt địa chỉ,
+        # payload tính sẵn 1 lần: (variant_lower, độ dài, official)
+        self._automaton = ahocorasick.Automaton()
+        for variant_lower, official in variants_lower.items():
+            self._automaton.add_word(variant_lower, (variant_lower, len(variant_lower), official))
+        self._automaton.make_automaton()
+    
+    def _load_cache(self, cache_file, signature):
+        """
+        Load các cấu trúc đã build từ cache nếu cache được build từ đúng file ground truth
+        
+        Args:
+            cache_file: File cache pickle
+            signature: (mtime_ns, size) hiện tại của file ground truth
+            
+        Returns:
+            True nếu load thành công, False nếu cần build lại
+        """
+        try:
+            with open(cache_file, 'rb') as f:
+                version, cached_signature, state = pickle.load(f)
+        except Exception:
+            # Không có cache, cache hỏng hoặc không tương thích -> build lại
+            return False
+        
+        # So khớp chính xác (không so mới/cũ): file thay bằng bản có mtime cũ hơn
+        # (cp -p, rsync -a, giải nén) vẫn bị phát hiện
+        if version != _CACHE_VERSION or tuple(cached_signature) != signature:
+            return False
+        
+        self.__dict__.update(state)
+        return True
+    
+    def _save_cache(self, cache_file, signature):
+        """Lưu các cấu trúc đã build ra cache (bỏ qua nếu không ghi được)"""
+        state = {name: getattr(self, name) for name in _CACHED_ATTRIBUTES}
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, 'wb') as f:
+                pickle.dump((_CACHE_VERSION, signature, state), f, protocol=pickle.HIGHEST_PROTOCOL)
+            # Ghi file tạm rồi rename để các process khác không đọc phải cache dở dang
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
     
     def extract_province(self, address):
         """
@@ -58,61 +174,60 @@ class ProvinceComparator:
         Returns:
             Tên chính thức của tỉnh (theo ground truth) hoặc None
         """
+        return self._extract_province_cached(address)
+    
+    def _extract_two(self, address1, address2):
+        """Trích xuất tỉnh/thành cho 2 địa chỉ liên tiếp (dùng chung cache)"""
+        extract = self._extract_province_cached
+        return extract(address1), extract(address2)
+    
+    def _extract_province_impl(self, address):
+        """Trích xuất tỉnh/thành từ địa chỉ (không qua cache)"""
         if not address:
             return None
         
         # Chuyển địa chỉ về lowercase để so sánh
         address_lower = address.lower()
         
-        # Thu thập tất cả các match với vị trí của chúng
-        candidates = []
+        address_len = len(address_lower)
         
-        for variant, official in self.variant_to_official.items():
-            variant_str = variant if isinstance(variant, str) else str(variant)
-            variant_lower = variant_str.lower()
-            
-            # Tìm match
-            match = None
-            is_word_boundary_match = False
-            
-            # 1. Thử word boundary match (chính xác hơn)
-            pattern = r'(?:^|[\s,;.\-/])(' + re.escape(variant_lower) + r')(?:[\s,;.\-/]|$)'
-            regex_match = re.search(pattern, address_lower)
-            
-            if regex_match:
-                match = regex_match
-                is_word_boundary_match = True
-            # 2. Substring match chỉ cho variants dài >= 4 ký tự
-            elif len(variant_str) >= 4 and variant_lower in address_lower:
-                match_pos = address_lower.find(variant_lower)
-                if match_pos >= 0:
-                    class PseudoMatch:
-                        def __init__(self, pos):
-                            self.start_pos = pos
-                        def start(self):
-                            return self.start_pos
-                    match = PseudoMatch(match_pos)
-                    is_word_boundary_match = False
+        # Với mỗi variant: word boundary match đầu tiên (chính xác hơn),
+        # hoặc substring match đầu tiên nếu variant dài >= 4 ký tự.
+        # Ưu tiên match xuất hiện SAU CÙNG (gần cuối địa chỉ nhất); nếu cùng vị trí,
+        # ưu tiên word boundary, sau đó ưu tiên variant dài hơn.
+        best_rank = (-1, False, 0)  # (position, is_word_boundary, length)
+        best_official = None
+        boundary_variants = set()
+        substring_matches = {}
+        
+        separators = _SEPARATORS
+        
+        for end, (variant_lower, length, official) in self._automaton.iter(address_lower):
+            if variant_lower in boundary_variants:
+                continue
             
-            if match:
-                # Lưu candidate với vị trí xuất hiện
-                candidates.append({
-                    'official': official,
-                    'variant': variant_str,
-                    'position': match.start(),
-                    'is_word_boundary': is_word_boundary_match,
-                    'length': len(variant_str)
-                })
-        
-        if not candidates:
-            return None
+            start = end - length + 1
+            if ((start == 0 or address_lower[start - 1] in separators) and
+                    (end + 1 == address_len or address_lower[end + 1] in separators)):
+                boundary_variants.add(variant_lower)
+                # Vị trí tính từ ký tự phân cách đứng trước (như regex trước đây)
+                rank = (max(start - 1, 0), True, length)
+                if rank > best_rank:
+                    best_rank = rank
+                    best_official = official
+            elif length >= 4 and variant_lower not in substring_matches:
+                substring_matches[variant_lower] = (start, length, official)
         
-        # Sắp xếp theo vị trí (ưu tiên match xuất hiện SAU CÙNG)
-        # Nếu cùng vị trí, ưu tiên word boundary, sau đó ưu tiên variant dài hơn
-        candidates.sort(key=lambda x: (x['position'], x['is_word_boundary'], x['length']))
+        # Substring match chỉ được tính khi variant không có word boundary match nào
+        for variant_lower, (position, length, official) in substring_matches.items():
+            if variant_lower in boundary_variants:
+                continue
+            rank = (position, False, length)
+            if rank > best_rank:
+                best_rank = rank
+                best_official = official
         
-        # Trả về match CUỐI CÙNG (xuất hiện gần cuối địa chỉ nhất)
-        return candidates[-1]['official']
+        return best_official
     
     def compare_provinces(self, prov1, prov2):
         """
@@ -132,21 +247,20 @@ class ProvinceComparator:
         if prov1 == prov2:
             return True, "Exact match"
         
+        merged1 = self.merged_provinces.get(prov1)
+        merged2 = self.merged_provinces.get(prov2)
+        
         # Check if prov1 was merged into prov2
-        if prov1 in self.merged_provinces:
-            if self.merged_provinces[prov1] == prov2:
-                return True, f"Match: {prov1} đã sáp nhập vào {prov2}"
+        if merged1 == prov2:
+            return True, f"Match: {prov1} đã sáp nhập vào {prov2}"
         
         # Check if prov2 was merged into prov1
-        if prov2 in self.merged_provinces:
-            if self.merged_provinces[prov2] == prov1:
-                return True, f"Match: {prov2} đã sáp nhập vào {prov1}"
+        if merged2 == prov1:
+            return True, f"Match: {prov2} đã sáp nhập vào {prov1}"
         
         # Check if both were merged into the same province
-        if prov1 in self.merged_provinces and prov2 in self.merged_provinces:
-            if self.merged_provinces[prov1] == self.merged_provinces[prov2]:
-                new_prov = self.merged_provinces[prov1]
-                return True, f"Match: Cả 2 đều sáp nhập vào {new_prov}"
+        if merged1 is not None and merged1 == merged2:
+            return True, f"Match: Cả 2 đều sáp nhập vào {merged1}"
         
         # No match
         return False, f"Mismatch: {prov1} ≠ {prov2}"
@@ -163,8 +277,7 @@ class ProvinceComparator:
         Returns:
             Dictionary với kết quả
         """
-        prov1 = self.extract_province(address1)
-        prov2 = self.extract_province(address2)
+        prov1, prov2 = self._extract_two(address1, address2)
         
         is_match, reason = self.compare_provinces(prov1, prov2)
         
@@ -177,3 +290,48 @@ class ProvinceComparator:
             "match": is_match,
             "reason": reason
         }
+    
+    def compare_batch(self, pairs):
+        """
+        So sánh nhiều cặp địa chỉ
+        
+        Args:
+            pairs: Iterable các tuple (index, address1, address2)
+            
+        Yields:
+            Dictionary kết quả cho từng cặp (như compare_address_pair)
+        """
+        compare_address_pair = self.compare_address_pair
+        for index, address1, address2 in pairs:
+            yield compare_address_pair(address1, address2, index)
+
+
+def read_address_pairs(csv_file):
+    """
+    Đọc các cặp địa chỉ hợp lệ từ file CSV (index, address1, address2, [label])
+    
+    Args:
+        csv_file: File CSV input
+        
+    Yields:
+        Tuple (index, addr1, addr2)
+    """
+    with open(csv_file, 'r', encoding='utf-8') as f:
+        for line_number, row in enumerate(csv.reader(f)):
+            # Skip empty rows or rows with MISMATCH/Ambiguity labels
+            if len(row) < 3:
+                continue
+            if len(row) > 3 and row[3] in SKIPPED_LABELS:
+                # Skip rows marked as MISMATCH or Ambiguity in column 4
+                continue
+            
+            index = row[0].strip()
+            # Skip header row (index, address1, address2, ...)
+            if line_number == 0 and index.lower() == 'index':
+                continue
+            
+            addr1 = row[1].strip()
+            addr2 = row[2].strip()
+            
+            if addr1 and addr2:
+                yield index, addr1, addr2
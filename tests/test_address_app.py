@@ -4,19 +4,27 @@ Gradio app để test so sánh địa chỉ
 
 import sys
 import os
+import functools
+
+# Tắt analytics của Gradio (request HTTPS + thread nền khi khởi động)
+os.environ.setdefault("GRADIO_ANALYTICS_ENABLED", "False")
 
 # Thêm thư mục gốc vào path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-import gradio as gr
-from src.province_comparator import ProvinceComparator
+from src.province_comparator import ProvinceComparator, read_address_pairs
 
 
-# Khởi tạo comparator
 data_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'tinh_thanh.json')
-comparator = ProvinceComparator(data_path)
 
 
+@functools.cache
+def _get_comparator():
+    """Khởi tạo comparator ở lần dùng đầu tiên (import module không phải load data)"""
+    return ProvinceComparator(data_path)
+
+
+@functools.lru_cache(maxsize=4096)
 def compare_addresses(address1, address2):
     """
     So sánh 2 địa chỉ và trả về kết quả
@@ -26,10 +34,12 @@ def compare_addresses(address1, address2):
         address2: Địa chỉ 2
         
     Returns:
-        Tuple (province1, province2, match_status, reason)
+        Tuple (province1, province2, is_match, reason)
     """
     if not address1 or not address2:
-        return "N/A", "N/A", "False", "Vui lòng nhập cả 2 địa chỉ"
+        return "N/A", "N/A", False, "Vui lòng nhập cả 2 địa chỉ"
+    
+    comparator = _get_comparator()
     
     # Trích xuất tỉnh
     prov1 = comparator.extract_province(address1)
@@ -39,65 +49,104 @@ def compare_addresses(address1, address2):
     is_match, reason = comparator.compare_provinces(prov1, prov2)
     
     # Format output
-    province1_display = prov1 if prov1 else "N/A"
-    province2_display = prov2 if prov2 else "N/A"
-    match_display = "True" if is_match else "False"
+    return prov1 or "N/A", prov2 or "N/A", is_match, reason
+
+
+def compare_csv(csv_path):
+    """
+    So sánh các cặp địa chỉ trong file CSV (cùng quy tắc đọc với process_csv)
     
-    return province1_display, province2_display, match_display, reason
+    Args:
+        csv_path: Đường dẫn file CSV upload
+        
+    Returns:
+        List các dòng kết quả cho bảng Batch
+    """
+    if not csv_path:
+        return []
+    
+    return [
+        [
+            result["index"], result["address1"], result["address2"],
+            result["province1"], result["province2"], result["match"], result["reason"]
+        ]
+        for result in _get_comparator().compare_batch(read_address_pairs(csv_path))
+    ]
 
 
-# Tạo Gradio interface
-with gr.Blocks(title="Address Comparison Tester") as demo:
-    gr.Markdown("# Address Comparison Tester")
-    gr.Markdown("Nhập 2 địa chỉ để so sánh tỉnh/thành phố")
+def build_demo():
+    """
+    Tạo Gradio interface
+    
+    Returns:
+        gr.Blocks demo
+    """
+    import gradio as gr
     
-    with gr.Row():
-        with gr.Column():
-            address1_input = gr.Textbox(
-                label="Address 1",
-                placeholder="Nhập địa chỉ 1...",
-                lines=2
+    with gr.Blocks(title="Address Comparison Tester") as demo:
+        gr.Markdown("# Address Comparison Tester")
+        gr.Markdown("Nhập 2 địa chỉ để so sánh tỉnh/thành phố")
+        
+        with gr.Tab("So sánh"):
+            with gr.Row():
+                with gr.Column():
+                    address1_input = gr.Textbox(
+                        label="Address 1",
+                        placeholder="Nhập địa chỉ 1...",
+                        lines=2
+                    )
+                    address2_input = gr.Textbox(
+                        label="Address 2",
+                        placeholder="Nhập địa chỉ 2...",
+                        lines=2
+                    )
+                    
+                    submit_btn = gr.Button("So sánh", variant="primary", size="lg")
+            
+            with gr.Row():
+                with gr.Column():
+                    province1_output = gr.Textbox(label="Province 1", interactive=False)
+                with gr.Column():
+                    province2_output = gr.Textbox(label="Province 2", interactive=False)
+            
+            with gr.Row():
+                match_output = gr.Checkbox(label="Match", interactive=False)
+            
+            with gr.Row():
+                reason_output = gr.Textbox(label="Reason", interactive=False, lines=2)
+            
+            # Kết nối button và Enter ở 2 ô địa chỉ với cùng 1 event
+            gr.on(
+                triggers=[submit_btn.click, address1_input.submit, address2_input.submit],
+                fn=compare_addresses,
+                inputs=[address1_input, address2_input],
+                outputs=[province1_output, province2_output, match_output, reason_output],
+                api_name="compare",
+                show_progress="hidden"
             )
-            address2_input = gr.Textbox(
-                label="Address 2",
-                placeholder="Nhập địa chỉ 2...",
-                lines=2
+        
+        with gr.Tab("Batch"):
+            csv_input = gr.File(label="CSV (index, address1, address2)", file_types=[".csv"])
+            batch_btn = gr.Button("So sánh file", variant="primary")
+            batch_output = gr.Dataframe(
+                headers=["Index", "Address 1", "Address 2", "Province 1", "Province 2", "Match", "Reason"],
+                interactive=False
             )
             
-            submit_btn = gr.Button("So sánh", variant="primary", size="lg")
-    
-    with gr.Row():
-        with gr.Column():
-            province1_output = gr.Textbox(label="Province 1", interactive=False)
-        with gr.Column():
-            province2_output = gr.Textbox(label="Province 2", interactive=False)
-    
-    with gr.Row():
-        match_output = gr.Textbox(label="Match", interactive=False)
-    
-    with gr.Row():
-        reason_output = gr.Textbox(label="Reason", interactive=False, lines=2)
-    
-    # Kết nối button với function
-    submit_btn.click(
-        fn=compare_addresses,
-        inputs=[address1_input, address2_input],
-        outputs=[province1_output, province2_output, match_output, reason_output]
-    )
+            batch_btn.click(
+                fn=compare_csv,
+                inputs=[csv_input],
+                outputs=[batch_output]
+            )
     
-    # Cho phép Enter để submit
-    address1_input.submit(
-        fn=compare_addresses,
-        inputs=[address1_input, address2_input],
-        outputs=[province1_output, province2_output, match_output, reason_output]
-    )
-    address2_input.submit(
-        fn=compare_addresses,
-        inputs=[address1_input, address2_input],
-        outputs=[province1_output, province2_output, match_output, reason_output]
-    )
+    return demo
 
 
 if __name__ == "__main__":
+    import gradio as gr
+    
     print(" Starting Address Comparison Tester...")
+    demo = build_demo()
+    # Xử lý song song nhiều request (compare_addresses không giữ state riêng)
+    demo.queue(default_concurrency_limit=os.cpu_count(), max_size=256)
     demo.launch(server_name="127.0.0.1", server_port=7861, share=False, theme=gr.themes.Soft())